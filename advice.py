@@ -1,43 +1,219 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import os
+import shutil
 import subprocess
-import requests
+import httpx
 import sys
+import threading
 import time
 import tempfile
 
+from openai_client import (
+    CACHE_DIR,
+    CACHE_TTL,
+    chat,
+    chat_many,
+    get_api_key,
+    write_cache_file,
+)
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # Without watchdog, interactive mode polls the prompt file instead.
+    Observer = None
+
+
+def read_source_file(path):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+
+def build_prompt(original_content, changes):
+    """
+    Builds the prompt asking the model to return the entire file with the
+    requested changes applied.
+    """
+    # We want the entire updated file as response, so prompt accordingly:
+    # e.g. "Here is the file content. Apply the requested changes and return
+    # the entire updated file. Do not omit any part of it."
+    return (
+        "You are a coding assistant. I have the following file:\n\n"
+        f"---\n{original_content}\n---\n\n"
+        "Please return the entire updated file with the changes applied (include comments on those if possible), "
+        "without omitting any part of the code. The result should be valid code only.\n"
+        f"I want to apply these changes:\n{changes}\n\n"
+    )
+
+
+def read_prompt_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def wait_for_prompt_edit(path, original_prompt):
+    """
+    Blocks until the prompt file is saved with content that differs from
+    original_prompt and is not empty, then returns that content.
+    Filesystem events are used when watchdog is installed; otherwise the
+    file is polled every second.
+    """
+    if Observer is None:
+        # Only read and decode the file again when a stat shows it was saved.
+        st = os.stat(path)
+        last_seen = (st.st_mtime_ns, st.st_size)
+        # The file may have been saved before the first stat above.
+        updated_prompt = read_prompt_file(path)
+        while updated_prompt == original_prompt or updated_prompt == "":
+            time.sleep(1)
+            st = os.stat(path)
+            if (st.st_mtime_ns, st.st_size) == last_seen:
+                continue
+            last_seen = (st.st_mtime_ns, st.st_size)
+            updated_prompt = read_prompt_file(path)
+        return updated_prompt
+
+    saved = threading.Event()
+
+    class PromptFileHandler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            # Only react to writes: our own reads emit "opened" events too.
+            if event.event_type not in ("modified", "closed", "created", "moved"):
+                return
+            if path in (event.src_path, getattr(event, "dest_path", None)):
+                saved.set()
+
+    observer = Observer()
+    observer.schedule(PromptFileHandler(), os.path.dirname(path))
+    observer.start()
+    try:
+        # Catch a save that happened before the observer was started.
+        updated_prompt = read_prompt_file(path)
+        if updated_prompt != original_prompt and updated_prompt != "":
+            return updated_prompt
+        while True:
+            saved.wait()
+            saved.clear()
+            updated_prompt = read_prompt_file(path)
+            if updated_prompt != original_prompt and updated_prompt != "":
+                return updated_prompt
+    finally:
+        observer.stop()
+        observer.join()
+
+
+def default_output_path(path):
+    """
+    Example: if the file is main.py -> main_modified.py
+    """
+    base_name, ext = os.path.splitext(path)
+    return f"{base_name}_modified{ext}"
+
+
+def output_cache_path(path, st, changes, reasoning_effort, cache_dir=CACHE_DIR):
+    """
+    Cache entry for the rewritten file, keyed on the source file's path,
+    mtime and size (from its stat result st) instead of its content, so a
+    hit is found without reading the file.
+    """
+    key = hashlib.blake2b(
+        f"{path}|{st.st_mtime_ns}|{st.st_size}|{changes}|{reasoning_effort}".encode(),
+        digest_size=16,
+    ).hexdigest()
+    return os.path.join(cache_dir, f"{key}.out")
+
+
+def load_cached_output(cache_file, source_mtime, ttl=CACHE_TTL):
+    """
+    Returns the cached rewritten file, or None if there is no entry, it is
+    not newer than the source file's source_mtime or it is older than ttl
+    seconds.
+    """
+    try:
+        cached_mtime = os.path.getmtime(cache_file)
+        if cached_mtime <= source_mtime:
+            return None
+        if time.time() - cached_mtime > ttl:
+            return None
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def run_batch(args):
+    """
+    Applies the same requested changes to every file in args.files,
+    sending one request per file concurrently.
+    """
+    missing = [path for path in args.files if not os.path.isfile(path)]
+    if missing:
+        print(f"Error: The provided files do not exist: {', '.join(missing)}")
+        sys.exit(1)
+
+    changes = input(
+        f"What changes do you want to make to {', '.join(args.files)}?\n"
+    ).strip()
+    messages_list = [
+        [{"role": "user", "content": build_prompt(read_source_file(path), changes)}]
+        for path in args.files
+    ]
+
+    print(f"Sending {len(messages_list)} requests to OpenAI...\n")
+    results = chat_many(
+        messages_list,
+        reasoning_effort=args.reasoning_effort,
+        use_cache=not args.no_cache,
+        ttl=args.cache_ttl,
+    )
+
+    failed = False
+    for path, result in zip(args.files, results):
+        if isinstance(result, Exception):
+            print(f"Request to OpenAI failed for {path}:\n{result}")
+            failed = True
+            continue
+        out_file = default_output_path(path)
+        try:
+            with open(out_file, "w", encoding="utf-8") as f:
+                f.write(result)
+        except OSError as e:
+            print(f"Error: Could not write to {out_file} - {e}")
+            failed = True
+            continue
+        print(f"Modified file saved to: {out_file}")
+
+    if failed:
+        sys.exit(1)
+
+
+def save_modified_file(out_file, modified_content):
+    """
+    Writes the modified file to disk and prints its content.
+    """
+    try:
+        with open(out_file, "w", encoding="utf-8") as f:
+            f.write(modified_content)
+    except OSError as e:
+        print(f"Error: Could not write to {out_file} - {e}")
+        sys.exit(1)
+
+    print(f"Modified file saved to: {out_file}\n")
+    print("=== Modified file content below ===\n")
+    print(modified_content)
+
 
 def main():
     ################################################################
-    # 0. Check API key or try sourcing /root/.openai_credentials
+    # 0. Load the API key (environment, cached key file or /root/.openai_credentials)
     ################################################################
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if not openai_api_key:
-        try:
-            # Attempt to load OPENAI_API_KEY via: source <(sudo cat /root/.openai_credentials)
-            openai_api_key = (
-                subprocess.check_output(
-                    [
-                        "bash",
-                        "-c",
-                        "source <(sudo cat /root/.openai_credentials) && echo $OPENAI_API_KEY",
-                    ],
-                    stderr=subprocess.STDOUT,
-                )
-                .decode()
-                .strip()
-            )
-            os.environ["OPENAI_API_KEY"] = openai_api_key
-        except subprocess.CalledProcessError as e:
-            print(
-                "Failed to retrieve OPENAI_API_KEY from /root/.openai_credentials:\n",
-                e.output.decode(),
-            )
-            sys.exit(1)
-
-    if not os.environ.get("OPENAI_API_KEY"):
-        print("Error: OPENAI_API_KEY is not set and could not be sourced. Exiting.")
+    try:
+        get_api_key()
+    except RuntimeError as e:
+        print(f"Error: {e}")
         sys.exit(1)
 
     ################################################################
@@ -48,10 +224,12 @@ def main():
     )
     # Changed the file argument from an optional flag (-f/--file) to a positional argument.
     # If not provided, the script will prompt the user.
+    # argparse opens it, so the existence check and the open are a single step.
     parser.add_argument(
         "file",
         nargs="?",
         default=None,
+        type=argparse.FileType("r", encoding="utf-8", errors="ignore"),
         help="Path to the file you want to modify. If not specified, you'll be prompted.",
     )
     parser.add_argument(
@@ -73,43 +251,87 @@ def main():
         action="store_true",
         help="Open the generated prompt in VS Code for interactive editing before sending it.",
     )
+    # Batch mode: apply the same changes to several files, one concurrent request per file.
+    parser.add_argument(
+        "--files",
+        nargs="+",
+        default=None,
+        help="Paths of several files to modify concurrently with the same changes. "
+        "Each result is saved to <file>_modified<ext>.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always send the request, ignoring and not updating the response cache.",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=CACHE_TTL,
+        help=f"Maximum age in seconds of a reusable cached response. Default: {CACHE_TTL} (7 days)",
+    )
     args = parser.parse_args()
 
+    if args.files:
+        if args.file or args.output or args.interactive:
+            parser.error(
+                "--files cannot be combined with file, --output or --interactive"
+            )
+        run_batch(args)
+        return
+
     ################################################################
-    # 2. If file is not provided, ask user
+    # 2. If file is not provided, ask user, then ask for the changes
     ################################################################
     if not args.file:
-        args.file = input("What file do you want to modify? ").strip()
-
-    if not args.file or not os.path.isfile(args.file):
-        print(f"Error: The provided file '{args.file}' does not exist.")
-        sys.exit(1)
+        path = input("What file do you want to modify? ").strip()
+        try:
+            args.file = open(path, "r", encoding="utf-8", errors="ignore")
+        except OSError:
+            print(f"Error: The provided file '{path}' does not exist.")
+            sys.exit(1)
+    path = args.file.name
+    # Stat the open handle, so the cache key matches what is read below.
+    source_stat = os.fstat(args.file.fileno())
 
-    ################################################################
-    # 3. Read the entire file content
-    ################################################################
-    with open(args.file, "r", encoding="utf-8", errors="ignore") as f:
-        original_content = f.read()
+    # Determine output filename
+    if args.output:
+        out_file = args.output
+    else:
+        out_file = default_output_path(path)
 
-    ################################################################
-    # 4. Build the request prompt to the OpenAI API
-    ################################################################
-    # We want the entire updated file as response, so prompt accordingly:
-    # e.g. "Here is the file content. Apply the requested changes and return
-    # the entire updated file. Do not omit any part of it."
     changes = (
         ""
         if args.interactive
-        else input(f"What changes do you want to make to {args.file}?\n").strip()
+        else input(f"What changes do you want to make to {path}?\n").strip()
     )
 
-    user_prompt = (
-        "You are a coding assistant. I have the following file:\n\n"
-        f"---\n{original_content}\n---\n\n"
-        "Please return the entire updated file with the changes applied (include comments on those if possible), "
-        "without omitting any part of the code. The result should be valid code only.\n"
-        f"I want to apply these changes:\n{changes}\n\n"
-    )
+    ################################################################
+    # 3. Reuse the result of an identical earlier run, if any
+    ################################################################
+    # Checked before reading the file, so a hit never reads the source file.
+    # The prompt of interactive runs is only known after editing, so those
+    # always go through the full request.
+    output_cache_file = None
+    if not args.interactive and not args.no_cache:
+        output_cache_file = output_cache_path(
+            path, source_stat, changes, args.reasoning_effort
+        )
+        cached_content = load_cached_output(
+            output_cache_file, source_stat.st_mtime, args.cache_ttl
+        )
+        if cached_content is not None:
+            args.file.close()
+            print("Reusing the result of an identical earlier run.\n")
+            save_modified_file(out_file, cached_content)
+            return
+
+    ################################################################
+    # 4. Read the file content and build the request prompt
+    ################################################################
+    original_content = args.file.read()
+    args.file.close()
+    user_prompt = build_prompt(original_content, changes)
 
     ################################################################
     # 4a. If interactive mode is enabled, allow user to edit the prompt.
@@ -135,16 +357,9 @@ def main():
             sys.exit(1)
 
         print("Waiting for you to modify the prompt file and save your changes...")
-        # Read the original content that was written.
-        original_prompt_content = user_prompt.strip()
-        updated_prompt = original_prompt_content
-
-        # Poll the file until its content changes (and is not empty).
+        # Wait until the file content changes (and is not empty).
         try:
-            while updated_prompt == original_prompt_content or updated_prompt == "":
-                time.sleep(1)
-                with open(tmp_filepath, "r", encoding="utf-8") as f:
-                    updated_prompt = f.read().strip()
+            updated_prompt = wait_for_prompt_edit(tmp_filepath, user_prompt.strip())
         except KeyboardInterrupt:
             print("\nEditing interrupted by user. Exiting.")
             sys.exit(1)
@@ -158,72 +373,55 @@ def main():
             print(f"Warning: Could not delete temporary file {tmp_filepath}: {e}")
 
     ################################################################
-    # 5. Build the request to the OpenAI API
-    ################################################################
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-
-    payload = {
-        "model": "o3-mini",  # The model you'd like to use
-        "reasoning_effort": args.reasoning_effort,
-        "messages": [
-            {
-                "role": "user",
-                "content": user_prompt,
-            }
-        ],
-    }
-
-    ################################################################
-    # 6. Send the request to OpenAI
+    # 5. Send the request to OpenAI and write the reply as it arrives
     ################################################################
+    # Identical requests answered within --cache-ttl are replayed from disk.
+    # The reply goes to a temporary file next to out_file, which only replaces
+    # it once the whole reply arrived, so a failed request never truncates it
+    # (even when out_file is the source file itself).
+    print(f"Writing modified file to: {out_file}\n")
+    print("=== Modified file content below ===\n")
+    tmp_out_file = f"{out_file}.{os.getpid()}.tmp"
+    pieces = []
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=180,  # longer timeout if needed
-        )
-        response.raise_for_status()
-    except requests.exceptions.RequestException as req_err:
-        print(f"Request to OpenAI failed:\n{req_err}")
+        with open(tmp_out_file, "w", encoding="utf-8") as f:
+            for piece in chat(
+                [{"role": "user", "content": user_prompt}],
+                reasoning_effort=args.reasoning_effort,
+                stream=True,
+                use_cache=not args.no_cache,
+                ttl=args.cache_ttl,
+                timeout=180,  # longer timeout if needed
+            ):
+                f.write(piece)
+                sys.stdout.write(piece)
+                sys.stdout.flush()
+                if output_cache_file:
+                    pieces.append(piece)
+        if os.path.exists(out_file):
+            # Keep the permissions of the file being replaced.
+            shutil.copymode(out_file, tmp_out_file)
+        os.replace(tmp_out_file, out_file)
+    except httpx.HTTPError as req_err:
+        print(f"\nRequest to OpenAI failed:\n{req_err}")
         sys.exit(1)
-
-    response_json = response.json()
-    if "choices" not in response_json or not response_json["choices"]:
-        print("Error: Unexpected response from OpenAI:", response_json)
+    except ValueError as e:
+        print(f"\nError: Unexpected response from OpenAI: {e}")
         sys.exit(1)
-
-    modified_content = response_json["choices"][0]["message"]["content"]
-
-    ################################################################
-    # 7. Determine output filename
-    ################################################################
-    if args.output:
-        out_file = args.output
-    else:
-        # Example: if the file is main.py -> main_modified.py
-        base_name, ext = os.path.splitext(args.file)
-        out_file = f"{base_name}_modified{ext}"
-
-    ################################################################
-    # 8. Write the modified file to disk
-    ################################################################
-    try:
-        with open(out_file, "w", encoding="utf-8") as f:
-            f.write(modified_content)
     except OSError as e:
-        print(f"Error: Could not write to {out_file} - {e}")
+        print(f"\nError: Could not write to {out_file} - {e}")
         sys.exit(1)
+    finally:
+        if os.path.exists(tmp_out_file):
+            os.remove(tmp_out_file)
+
+    if output_cache_file:
+        write_cache_file(output_cache_file, "".join(pieces))
 
     ################################################################
-    # 9. Print success message
+    # 6. Print success message
     ################################################################
-    print(f"Modified file saved to: {out_file}\n")
-    print("=== Modified file content below ===\n")
-    print(modified_content)
+    print(f"\n\nModified file saved to: {out_file}")
 
 
 if __name__ == "__main__":
@@ -8,4 +8,6 @@ sudo cp prompt-advice.py /usr/local/bin/prompt-advice
 sudo chmod +x /usr/local/bin/prompt-advice
 
 SITE_PACKAGES=$(python3 -c 'import site; print(site.getsitepackages()[0])')
-sudo cp prompt_utils.py $SITE_PACKAGES
\ No newline at end of file
+sudo cp prompt_utils.py $SITE_PACKAGES
+sudo cp keys.py $SITE_PACKAGES
+sudo cp openai_client.py $SITE_PACKAGES
\ No newline at end of file
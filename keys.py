@@ -0,0 +1,77 @@
+import os
+import subprocess
+
+CREDENTIALS_FILE = "/root/.openai_credentials"
+KEY_FILE = os.path.expanduser("~/.config/automated-tools/openai.key")
+
+
+def read_key_file(path=KEY_FILE):
+    """
+    Returns the key stored in the given file, or None if there is none.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_key_file(key, path=KEY_FILE):
+    """
+    Stores the key in the given file, readable only by the current user.
+    """
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(key + "\n")
+
+
+def get_openai_key():
+    """
+    Returns the OpenAI API key and sets it as OPENAI_API_KEY.
+
+    The key is looked up in the OPENAI_API_KEY environment variable, then in
+    ~/.config/automated-tools/openai.key and finally by sourcing
+    /root/.openai_credentials through sudo. A key obtained through sudo is
+    saved to the key file so later runs don't need sudo again.
+
+    Raises RuntimeError if the key cannot be found.
+    """
+    openai_api_key = os.environ.get("OPENAI_API_KEY") or read_key_file()
+    if not openai_api_key:
+        try:
+            # Attempt to load OPENAI_API_KEY via: source <(sudo cat /root/.openai_credentials)
+            # stderr is kept apart, so sudo or bash messages never end up in the key.
+            openai_api_key = (
+                subprocess.check_output(
+                    [
+                        "bash",
+                        "-c",
+                        f"source <(sudo cat {CREDENTIALS_FILE}) && echo $OPENAI_API_KEY",
+                    ],
+                    stderr=subprocess.PIPE,
+                )
+                .decode()
+                .strip()
+            )
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(
+                f"Failed to retrieve OPENAI_API_KEY from {CREDENTIALS_FILE}:\n"
+                f"{e.stderr.decode()}"
+            ) from e
+        if not openai_api_key:
+            raise RuntimeError("OPENAI_API_KEY is not set and could not be sourced.")
+        # The key is saved below, so make sure it is a plausible one first.
+        if any(c.isspace() for c in openai_api_key):
+            raise RuntimeError(
+                f"OPENAI_API_KEY sourced from {CREDENTIALS_FILE} is not a single "
+                "word; check that the file only sets the key."
+            )
+        try:
+            write_key_file(openai_api_key)
+        except OSError:
+            # Not being able to cache the key only costs a sudo call next time.
+            pass
+
+    os.environ["OPENAI_API_KEY"] = openai_api_key
+    return openai_api_key
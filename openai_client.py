@@ -0,0 +1,313 @@
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import random
+import time
+
+import httpx
+
+from keys import get_openai_key
+
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+CACHE_DIR = os.path.expanduser("~/.cache/automated-tools")
+CACHE_TTL = 7 * 24 * 60 * 60  # one week, in seconds
+RETRY_ATTEMPTS = 5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Timeouts, failed connects and connections dropped or reset mid-request,
+# e.g. a pooled keep-alive connection the server has already closed.
+RETRY_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+OPENAI_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100)
+
+# One keep-alive HTTP/2 client per process, so repeated requests reuse the
+# same TLS connection instead of paying a new handshake each time.
+SESSION = httpx.Client(http2=True, limits=OPENAI_LIMITS, timeout=180)
+atexit.register(SESSION.close)
+
+_API_KEY = None
+
+
+def get_api_key():
+    """
+    Returns the OpenAI API key, looking it up only once per process.
+    See keys.get_openai_key() for where it is looked up.
+    Raises RuntimeError if the key cannot be found.
+    """
+    global _API_KEY
+    if _API_KEY is None:
+        _API_KEY = get_openai_key()
+    return _API_KEY
+
+
+def _headers():
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {get_api_key()}",
+    }
+
+
+def extract_content(response_json):
+    """
+    Returns the content of the first choice of a chat completion response.
+    """
+    if "choices" not in response_json or not response_json["choices"]:
+        raise ValueError(f"Unexpected response from OpenAI: {response_json}")
+    return response_json["choices"][0]["message"]["content"]
+
+
+def cache_path(payload, cache_dir=CACHE_DIR):
+    """
+    The cache key is the SHA256 of the request payload, so only
+    byte-identical requests share an entry. The API key is not part of it.
+    """
+    key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+def load_cached_content(payload, ttl=CACHE_TTL, cache_dir=CACHE_DIR):
+    """
+    Returns the cached reply for the payload, or None if there is no entry
+    or it is older than ttl seconds.
+    """
+    path = cache_path(payload, cache_dir)
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return extract_content(json.load(f))
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+def write_cache_file(path, text):
+    """
+    Atomically writes a cache entry. Failing to do so is not fatal.
+    Entries hold source files and model replies, so both the cache
+    directory and its files are only accessible by the current user.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not write cache file {path}: {e}")
+
+
+def store_cached_response(payload, response_json, cache_dir=CACHE_DIR):
+    """
+    Writes the response to the cache.
+    """
+    write_cache_file(cache_path(payload, cache_dir), json.dumps(response_json))
+
+
+def retry_delay(attempt, response=None):
+    """
+    Seconds to wait before retrying after the given attempt (starting at 1).
+    Honours the Retry-After header when the server sent one, otherwise uses
+    a random exponential backoff between 1 and 30 seconds.
+    """
+    if response is not None:
+        try:
+            return max(0.0, float(response.headers.get("Retry-After", "")))
+        except ValueError:
+            pass
+    return random.uniform(1, min(30, 2**attempt))
+
+
+def post_with_retry(payload, timeout, stream=False):
+    """
+    Posts the payload on SESSION, retrying timeouts, connection errors
+    (RETRY_ERRORS) and 429/5xx responses up to RETRY_ATTEMPTS times. The
+    last response is returned as-is so the caller can raise_for_status()
+    on it. With stream=True the body is left unread and the caller must
+    close the response.
+    """
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        request = SESSION.build_request(
+            "POST",
+            OPENAI_CHAT_URL,
+            headers=_headers(),
+            json=payload,
+            timeout=timeout,
+        )
+        try:
+            response = SESSION.send(request, stream=stream)
+        except RETRY_ERRORS as e:
+            if attempt == RETRY_ATTEMPTS:
+                raise
+            delay = retry_delay(attempt)
+            print(f"Request to OpenAI failed ({e}), retrying in {delay:.1f}s...")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == RETRY_ATTEMPTS:
+                return response
+            response.close()
+            delay = retry_delay(attempt, response)
+            print(
+                f"OpenAI returned {response.status_code}, retrying in {delay:.1f}s..."
+            )
+        time.sleep(delay)
+
+
+async def apost_with_retry(session, payload, timeout):
+    """
+    Async counterpart of post_with_retry() sending the request on the
+    given session.
+    """
+    for attempt in range(1, RETRY_ATTEMPTS + 1):
+        try:
+            response = await session.post(
+                OPENAI_CHAT_URL,
+                json=payload,
+                timeout=timeout,
+            )
+        except RETRY_ERRORS as e:
+            if attempt == RETRY_ATTEMPTS:
+                raise
+            delay = retry_delay(attempt)
+            print(f"Request to OpenAI failed ({e}), retrying in {delay:.1f}s...")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == RETRY_ATTEMPTS:
+                return response
+            delay = retry_delay(attempt, response)
+            print(
+                f"OpenAI returned {response.status_code}, retrying in {delay:.1f}s..."
+            )
+        await asyncio.sleep(delay)
+
+
+def _stream_chat(payload, use_cache, ttl, timeout):
+    if use_cache:
+        content = load_cached_content(payload, ttl)
+        if content is not None:
+            yield content
+            return
+
+    pieces = []
+    done = False
+    response = post_with_retry({**payload, "stream": True}, timeout, stream=True)
+    try:
+        response.raise_for_status()
+        # Server-sent events: one "data: <json>" line per chunk.
+        for line in response.iter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: ") :]
+            if data == "[DONE]":
+                done = True
+                break
+            chunk = json.loads(data)
+            if not chunk.get("choices"):
+                continue
+            piece = chunk["choices"][0].get("delta", {}).get("content")
+            if piece:
+                if use_cache:
+                    pieces.append(piece)
+                yield piece
+    finally:
+        response.close()
+
+    # A stream cut off before [DONE] holds a truncated reply: never cache it.
+    if not done:
+        raise ValueError("Stream ended before the reply was complete")
+    if use_cache:
+        store_cached_response(
+            payload,
+            {
+                "choices": [
+                    {"message": {"role": "assistant", "content": "".join(pieces)}}
+                ]
+            },
+        )
+
+
+def chat(
+    messages,
+    *,
+    model="o3-mini",
+    reasoning_effort="medium",
+    stream=False,
+    use_cache=True,
+    ttl=CACHE_TTL,
+    timeout=180,
+):
+    """
+    Sends a chat completion request and returns the reply content.
+
+    With stream=True a generator is returned instead, yielding the reply
+    piece by piece as it arrives. Identical requests answered within the
+    last ttl seconds are served from the on-disk cache (replayed as a
+    single piece when streaming). Raises httpx.HTTPError if the request
+    fails and ValueError if the response is malformed or, when streaming,
+    ends before the reply is complete.
+    """
+    payload = {
+        "model": model,
+        "reasoning_effort": reasoning_effort,
+        "messages": messages,
+    }
+    if stream:
+        return _stream_chat(payload, use_cache, ttl, timeout)
+
+    if use_cache:
+        content = load_cached_content(payload, ttl)
+        if content is not None:
+            return content
+
+    response = post_with_retry(payload, timeout)
+    response.raise_for_status()
+    response_json = response.json()
+    content = extract_content(response_json)
+    if use_cache:
+        store_cached_response(payload, response_json)
+    return content
+
+
+async def _achat(session, payload, use_cache, ttl, timeout):
+    if use_cache:
+        content = load_cached_content(payload, ttl)
+        if content is not None:
+            return content
+
+    response = await apost_with_retry(session, payload, timeout)
+    response.raise_for_status()
+    response_json = response.json()
+    content = extract_content(response_json)
+    if use_cache:
+        store_cached_response(payload, response_json)
+    return content
+
+
+async def _chat_many(payloads, use_cache, ttl, timeout):
+    async with httpx.AsyncClient(
+        headers=_headers(), http2=True, limits=OPENAI_LIMITS, timeout=timeout
+    ) as session:
+        return await asyncio.gather(
+            *[_achat(session, p, use_cache, ttl, timeout) for p in payloads],
+            return_exceptions=True,
+        )
+
+
+def chat_many(
+    messages_list,
+    *,
+    model="o3-mini",
+    reasoning_effort="medium",
+    use_cache=True,
+    ttl=CACHE_TTL,
+    timeout=180,
+):
+    """
+    Sends one chat completion request per entry of messages_list
+    concurrently, so the batch takes roughly as long as the slowest single
+    request. Returns the reply contents in the same order, with failed
+    requests returned as exceptions in place of their content.
+    """
+    payloads = [
+        {"model": model, "reasoning_effort": reasoning_effort, "messages": messages}
+        for messages in messages_list
+    ]
+    return asyncio.run(_chat_many(payloads, use_cache, ttl, timeout))
@@ -2,42 +2,22 @@
 import argparse
 import os
 import subprocess
-import requests
+import httpx
 import sys
 import time
 import tempfile
 
+from openai_client import CACHE_TTL, chat, get_api_key
+
 
 def main():
     ################################################################
-    # 0. Check API key or try sourcing /root/.openai_credentials
+    # 0. Load the API key (environment, cached key file or /root/.openai_credentials)
     ################################################################
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if not openai_api_key:
-        try:
-            # Attempt to load OPENAI_API_KEY via: source <(sudo cat /root/.openai_credentials)
-            openai_api_key = (
-                subprocess.check_output(
-                    [
-                        "bash",
-                        "-c",
-                        "source <(sudo cat /root/.openai_credentials) && echo $OPENAI_API_KEY",
-                    ],
-                    stderr=subprocess.STDOUT,
-                )
-                .decode()
-                .strip()
-            )
-            os.environ["OPENAI_API_KEY"] = openai_api_key
-        except subprocess.CalledProcessError as e:
-            print(
-                "Failed to retrieve OPENAI_API_KEY from /root/.openai_credentials:\n",
-                e.output.decode(),
-            )
-            sys.exit(1)
-
-    if not os.environ.get("OPENAI_API_KEY"):
-        print("Error: OPENAI_API_KEY is not set and could not be sourced. Exiting.")
+    try:
+        get_api_key()
+    except RuntimeError as e:
+        print(f"Error: {e}")
         sys.exit(1)
 
     ################################################################
@@ -73,6 +53,17 @@ def main():
         action="store_true",
         help="Open the generated prompt in VS Code for interactive editing before sending it.",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always send the request, ignoring and not updating the response cache.",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=CACHE_TTL,
+        help=f"Maximum age in seconds of a reusable cached response. Default: {CACHE_TTL} (7 days)",
+    )
     args = parser.parse_args()
 
     ################################################################
@@ -160,48 +151,26 @@ def main():
             print(f"Warning: Could not delete temporary file {tmp_filepath}: {e}")
 
     ################################################################
-    # 5. Build the request to the OpenAI API
-    ################################################################
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-
-    payload = {
-        "model": "o3-mini",  # The model you'd like to use
-        "reasoning_effort": args.reasoning_effort,
-        "messages": [
-            {
-                "role": "user",
-                "content": user_prompt,
-            }
-        ],
-    }
-
-    ################################################################
-    # 6. Send the request to OpenAI
+    # 5. Send the request to OpenAI
     ################################################################
+    # Identical requests answered within --cache-ttl are served from disk.
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
+        modified_content = chat(
+            [{"role": "user", "content": user_prompt}],
+            reasoning_effort=args.reasoning_effort,
+            use_cache=not args.no_cache,
+            ttl=args.cache_ttl,
             timeout=180,  # longer timeout if needed
         )
-        response.raise_for_status()
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         print(f"Request to OpenAI failed:\n{req_err}")
         sys.exit(1)
-
-    response_json = response.json()
-    if "choices" not in response_json or not response_json["choices"]:
-        print("Error: Unexpected response from OpenAI:", response_json)
+    except ValueError as e:
+        print(f"Error: {e}")
         sys.exit(1)
 
-    modified_content = response_json["choices"][0]["message"]["content"]
-
     ################################################################
-    # 7. Determine output filename
+    # 6. Determine output filename
     ################################################################
     if args.output:
         out_file = args.output
@@ -211,7 +180,7 @@ def main():
         out_file = f"{base_name}_modified{ext}"
 
     ################################################################
-    # 8. Write the modified file to disk
+    # 7. Write the modified file to disk
     ################################################################
     try:
         with open(out_file, "w", encoding="utf-8") as f:
@@ -221,7 +190,7 @@ def main():
         sys.exit(1)
 
     ################################################################
-    # 9. Print success message
+    # 8. Print success message
     ################################################################
     print(f"Modified file saved to: {out_file}\n")
     print("=== Modified file content below ===\n")
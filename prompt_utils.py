@@ -1,18 +1,48 @@
+import functools
 import os
 import re
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Regular expression for file-based placeholders:
+_FILE_RE = re.compile(r"\[#PLACEHOLDER_LOAD_FROM_FILE\s*\(\s*([^)]+?)\s*\)\]")
+# Regular expression for git-based placeholders:
+_GIT_RE = re.compile(
+    r"\[#PLACEHOLDER_LOAD_FILE_FROM_GIT\s*\(\s*([^,]+?)\s*,\s*([^,]+?)\s*,\s*([^)]+?)\s*\)\]"
+)
+# Common prefix of both placeholder types, used to skip prompts without any.
+_PLACEHOLDER_PREFIX = "[#PLACEHOLDER_"
+# Number of placeholders loaded concurrently (git clones/fetches are I/O bound).
+_MAX_WORKERS = 8
+
+# Placeholders are loaded from several threads; two of them must not
+# clone or fetch the same repository at the same time.
+_REPO_LOCKS = {}
+_REPO_LOCKS_GUARD = threading.Lock()
+
+
+def _repo_lock(repo_path):
+    with _REPO_LOCKS_GUARD:
+        return _REPO_LOCKS.setdefault(repo_path, threading.Lock())
+
+
+@functools.lru_cache(maxsize=256)
+def _read_file(filepath):
+    with open(filepath, "r", encoding="utf-8") as f:
+        return f.read()
 
 
 def unroll_prompt_from_file(filename, dir=None):
     """
     Reads the file content from a directory specified by the
     ASSISTANTS_DIR environment variable.
+    Results are cached by absolute path, so each file is read at most once
+    per process, even if ASSISTANTS_DIR or the working directory change.
     """
     base_dir = dir if dir else os.environ.get("ASSISTANTS_DIR", "")
-    filepath = os.path.join(base_dir, filename)
-    with open(filepath, "r", encoding="utf-8") as f:
-        content = f.read()
-    return content
+    filepath = os.path.abspath(os.path.join(base_dir, filename))
+    return _read_file(filepath)
 
 
 def get_repo_name(git_url):
@@ -32,10 +62,13 @@ def get_repo_name(git_url):
     return part
 
 
+@functools.lru_cache(maxsize=256)
 def unroll_prompt_from_git(git_url, file_location, branch):
     """
     Clones (or updates) a repository in a local 'repos' folder,
     then retrieves the content of a file from the specified branch.
+    branch may also be a tag or a full commit SHA.
+    Results are cached, so each file is fetched at most once per process.
     """
     repo_name = get_repo_name(git_url)
     repos_dir = "repos"
@@ -44,27 +77,99 @@ def unroll_prompt_from_git(git_url, file_location, branch):
     # Ensure the 'repos' folder exists.
     os.makedirs(repos_dir, exist_ok=True)
 
-    if not os.path.exists(repo_path):
-        # Clone the repository if it does not exist.
-        subprocess.run(["git", "clone", git_url, repo_path], check=True)
-    else:
-        # If it exists, fetch the latest changes.
-        subprocess.run(["git", "-C", repo_path, "fetch"], check=True)
-
-    # Use 'git show' to get the content of the file at the given branch.
-    # This avoids having to checkout branches.
-    result = subprocess.run(
-        ["git", "-C", repo_path, "show", f"{branch}:{file_location}"],
-        capture_output=True,
-        text=True,
-        check=True,
-    )
+    with _repo_lock(repo_path):
+        if not os.path.exists(repo_path):
+            # Clone the repository if it does not exist. Only a single revision
+            # is needed, so skip the history and let git fetch blobs on demand.
+            subprocess.run(
+                [
+                    "git",
+                    "clone",
+                    "--depth=1",
+                    "--filter=blob:none",
+                    "--no-checkout",
+                    git_url,
+                    repo_path,
+                ],
+                check=True,
+            )
+
+        # Fetch the requested branch, tag or commit. Unlike a refspec, a bare
+        # revision works for all three, and FETCH_HEAD points at what was fetched.
+        subprocess.run(
+            ["git", "-C", repo_path, "fetch", "--depth=1", "origin", branch],
+            check=True,
+        )
+
+        # Use 'git show' to get the content of the file at that revision.
+        # This avoids having to checkout branches, and with the partial clone
+        # only this one blob is downloaded. FETCH_HEAD is shared by the whole
+        # repository, so this must happen under the same lock as the fetch.
+        result = subprocess.run(
+            ["git", "-C", repo_path, "show", f"FETCH_HEAD:{file_location}"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
     return result.stdout
 
 
+def _file_key(match):
+    return ("LOAD_FROM_FILE", match.group(1).strip())
+
+
+def _git_key(match):
+    return (
+        "LOAD_FROM_GIT",
+        match.group(1).strip(),
+        match.group(2).strip(),
+        match.group(3).strip(),
+    )
+
+
+def _load_placeholder(key):
+    """
+    Loads the content for a placeholder command tuple, or an error message
+    to use in its place if loading fails.
+    """
+    if key[0] == "LOAD_FROM_FILE":
+        filename = key[1]
+        try:
+            return unroll_prompt_from_file(filename)
+        except Exception as e:
+            return f"[Error loading file '{filename}': {e}]"
+
+    _, git_url, file_location, branch = key
+    try:
+        return unroll_prompt_from_git(git_url, file_location, branch)
+    except Exception as e:
+        return f"[Error loading from git ({git_url}, {file_location}, {branch}): {e}]"
+
+
+def _split_placeholders(text):
+    """
+    Splits text into literal strings and (key, placeholder text) tuples,
+    in order of appearance.
+    """
+    matches = [(m, _file_key(m)) for m in _FILE_RE.finditer(text)]
+    matches += [(m, _git_key(m)) for m in _GIT_RE.finditer(text)]
+    matches.sort(key=lambda item: item[0].start())
+    parts = []
+    pos = 0
+    for match, key in matches:
+        if match.start() < pos:
+            continue
+        parts.append(text[pos : match.start()])
+        parts.append((key, match.group(0)))
+        pos = match.end()
+    parts.append(text[pos:])
+    return parts
+
+
 def unroll_prompt(prompt, visited=None):
     """
-    Recursively replaces placeholders in the prompt with their loaded content.
+    Replaces placeholders in the prompt with their loaded content, and the
+    placeholders inside that content in turn, one nesting level at a time.
 
     There are two placeholder types:
 
@@ -74,56 +179,56 @@ def unroll_prompt(prompt, visited=None):
     2. [#PLACEHOLDER_LOAD_FILE_FROM_GIT (<git_url_ssh>, <file_location>, <branch>)]
        -> Clones or updates a git repository and loads content from a file in that repo.
 
-    The visited set (of command tuples) prevents the same placeholder command
-    from being processed more than once (avoiding infinite recursion).
+    Every occurrence of a placeholder is expanded, repeated ones from the
+    loader cache. Only a placeholder that would include itself, i.e. whose
+    command tuple is already among the ones it is nested in, is left as is
+    to break the cycle. The optional visited set holds command tuples to
+    treat as already being expanded.
     """
-    if visited is None:
-        visited = set()
-
-    # Regular expression for file-based placeholders:
-    file_pattern = re.compile(r"\[#PLACEHOLDER_LOAD_FROM_FILE\s*\(\s*([^)]+?)\s*\)\]")
-    # Regular expression for git-based placeholders:
-    git_pattern = re.compile(
-        r"\[#PLACEHOLDER_LOAD_FILE_FROM_GIT\s*\(\s*([^,]+?)\s*,\s*([^,]+?)\s*,\s*([^)]+?)\s*\)\]"
-    )
-
-    def file_repl(match):
-        filename = match.group(1).strip()
-        key = ("LOAD_FROM_FILE", filename)
-        if key in visited:
-            # Already processed this file; avoid reprocessing.
-            return match.group(0)
-        visited.add(key)
-        try:
-            content = unroll_prompt_from_file(filename)
-        except Exception as e:
-            content = f"[Error loading file '{filename}': {e}]"
-        # Process any placeholders within the loaded content recursively.
-        return unroll_prompt(content, visited)
-
-    def git_repl(match):
-        git_url = match.group(1).strip()
-        file_location = match.group(2).strip()
-        branch = match.group(3).strip()
-        key = ("LOAD_FROM_GIT", git_url, file_location, branch)
-        if key in visited:
-            return match.group(0)
-        visited.add(key)
-        try:
-            content = unroll_prompt_from_git(git_url, file_location, branch)
-        except Exception as e:
-            content = (
-                f"[Error loading from git ({git_url}, {file_location}, {branch}): {e}]"
+    # Each node is one piece of text to expand, together with the command
+    # tuples of the placeholders it is nested in.
+    root = {"text": prompt, "ancestors": frozenset(visited or ())}
+    levels = []
+    frontier = [root]
+    # Worker threads are only started once there is something to load.
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+        while frontier:
+            levels.append(frontier)
+            children = []
+            for node in frontier:
+                # Most loaded content has no placeholders at all, skip the regexes then.
+                if _PLACEHOLDER_PREFIX not in node["text"]:
+                    node["parts"] = [node["text"]]
+                    continue
+                node["parts"] = _split_placeholders(node["text"])
+                for i, part in enumerate(node["parts"]):
+                    if isinstance(part, str):
+                        continue
+                    key, placeholder = part
+                    if key in node["ancestors"]:
+                        # Expanding it would include itself again.
+                        node["parts"][i] = placeholder
+                        continue
+                    child = {"key": key, "ancestors": node["ancestors"] | {key}}
+                    node["parts"][i] = child
+                    children.append(child)
+
+            # Load each distinct placeholder of this nesting level once, all of
+            # them concurrently, so the slow git ones don't wait for each other.
+            keys = list(dict.fromkeys(child["key"] for child in children))
+            loaded = dict(zip(keys, executor.map(_load_placeholder, keys)))
+            for child in children:
+                child["text"] = loaded[child["key"]]
+            frontier = children
+
+    # Join the pieces back together, deepest level first.
+    for level in reversed(levels):
+        for node in level:
+            node["text"] = "".join(
+                part if isinstance(part, str) else part["text"]
+                for part in node["parts"]
             )
-        # Recursively process the loaded content.
-        return unroll_prompt(content, visited)
-
-    # First, replace any file-based placeholders.
-    prompt = file_pattern.sub(file_repl, prompt)
-    # Then, replace any git-based placeholders.
-    prompt = git_pattern.sub(git_repl, prompt)
-
-    return prompt
+    return root["text"]
 
 
 # Example usage:
@@ -1,9 +1,95 @@
 #!/usr/bin/env python3
+import io
 import os
 import subprocess
-import requests
+import httpx
 import argparse  # Added argparse to handle command line arguments
 
+from openai_client import CACHE_TTL, chat, get_api_key
+
+
+def parse_raw_numstat(output):
+    """
+    Parses `git diff --raw --numstat -z --no-abbrev` output into
+    (path, is_binary, object name) tuples. The object name is the blob on
+    the new side of the diff, or None for deleted files. Binary files have
+    "-" instead of line counts, and renamed or copied files are reported
+    with their new path.
+    """
+    fields = output.split(b"\0")
+    object_names = []
+    i = 0
+    # The --raw records come first: ":<old mode> <new mode> <old object>
+    # <new object> <status>", then the path, or the old and new paths for
+    # renames and copies.
+    while i < len(fields) and fields[i].startswith(b":"):
+        _, _, _, new_object, status = fields[i].split(b" ")
+        object_names.append(None if status == b"D" else new_object.decode())
+        i += 3 if status[:1] in (b"R", b"C") else 2
+
+    changed_files = []
+    while i < len(fields):
+        record = fields[i]
+        i += 1
+        if not record:
+            continue
+        added, _, path = record.split(b"\t", 2)
+        if not path:
+            # Renames and copies: the old and new paths follow as separate fields.
+            path = fields[i + 1]
+            i += 2
+        changed_files.append((os.fsdecode(path), added == b"-"))
+    return [
+        (path, is_binary, object_name)
+        for (path, is_binary), object_name in zip(changed_files, object_names)
+    ]
+
+
+def git_batch(batch_format, object_specs, check_only=False):
+    """
+    Runs a single `git cat-file --batch[-check]=<format>` over all object
+    specs (e.g. object names) and returns its raw output.
+    """
+    mode = "--batch-check" if check_only else "--batch"
+    return subprocess.check_output(
+        ["git", "cat-file", f"{mode}={batch_format}"],
+        input=b"".join(os.fsencode(spec) + b"\n" for spec in object_specs),
+        stderr=subprocess.PIPE,
+    )
+
+
+def git_blob_sizes(object_names):
+    """
+    Returns the size of each object, or None for objects that are missing
+    or not blobs (e.g. submodule commits).
+    """
+    output = git_batch("%(objecttype) %(objectsize)", object_names, True)
+    sizes = []
+    for line in output.splitlines():
+        # Missing objects are reported as "<object name> missing" instead.
+        fields = line.split(b" ")
+        if len(fields) == 2 and fields[0] == b"blob":
+            sizes.append(int(fields[1]))
+        else:
+            sizes.append(None)
+    return sizes
+
+
+def git_blob_contents(object_names):
+    """
+    Returns the content of each blob in a single `git cat-file --batch` call.
+    """
+    output = git_batch("%(objectsize)", object_names)
+    contents = []
+    pos = 0
+    for _ in object_names:
+        header_end = output.index(b"\n", pos)
+        start = header_end + 1
+        end = start + int(output[pos:header_end])
+        contents.append(output[start:end])
+        pos = end + 1  # skip the newline after the content
+    return contents
+
 
 def main():
     # Parse command line arguments
@@ -26,44 +112,36 @@ def main():
         action="store_true",
         help="Generate a short pull request description instead of a code review",
     )
+    # --no-cache / --cache-ttl: Control reuse of responses to identical requests.
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always send the request, ignoring and not updating the response cache",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=CACHE_TTL,
+        help=f"Maximum age in seconds of a reusable cached response (default: {CACHE_TTL}, 7 days)",
+    )
+    # --max-prompt-chars: Stop adding file contents once the prompt would exceed this size.
+    parser.add_argument(
+        "--max-prompt-chars",
+        type=int,
+        default=None,
+        help="Maximum prompt size in characters; file contents that would exceed it are left out (default: no limit)",
+    )
     args = parser.parse_args()
 
     # Use the provided commit for diff; default to HEAD^1 if not specified.
     revision = args.branch
     generate_pr_desc = args.description
 
-    # If OPENAI_API_KEY is not set, try sourcing it from /root/.openai_credentials
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if not openai_api_key:
-        try:
-            # Here, we run a Bash shell that does:
-            #   source <(sudo cat /root/.openai_credentials)
-            # then echoes the variable, capturing it in Python
-            openai_api_key = (
-                subprocess.check_output(
-                    [
-                        "bash",
-                        "-c",
-                        "source <(sudo cat /root/.openai_credentials) && echo $OPENAI_API_KEY",
-                    ],
-                    stderr=subprocess.STDOUT,
-                )
-                .decode()
-                .strip()
-            )
-            # Set it in the environment for this script’s lifetime
-            os.environ["OPENAI_API_KEY"] = openai_api_key
-
-        except subprocess.CalledProcessError as e:
-            print(
-                "Failed to retrieve OPENAI_API_KEY from /root/.openai_credentials:\n",
-                e.output.decode(),
-            )
-            return
-
-    # Sanity check if we *still* don't have it
-    if not os.environ.get("OPENAI_API_KEY"):
-        print("Error: OPENAI_API_KEY is not set and could not be sourced. Exiting.")
+    # Take OPENAI_API_KEY from the environment, the cached key file or /root/.openai_credentials
+    try:
+        get_api_key()
+    except RuntimeError as e:
+        print(f"Error: {e}")
         return
 
     ################################################################
@@ -87,16 +165,24 @@ def main():
     # 2. Get the list of changed files between the specified commit and HEAD
     ################################################################
     try:
-        # Changed from "git diff-tree" to "git diff --name-only <revision> HEAD"
-        changed_files_output = (
+        # Changed from "git diff --name-only" to "git diff --raw --numstat -z <revision> HEAD":
+        # NUL-delimited paths survive spaces and newlines, binary files are flagged
+        # and each file comes with the name of its blob at HEAD.
+        changed_files = parse_raw_numstat(
             subprocess.check_output(
-                ["git", "diff", "--name-only", revision, "HEAD"],
+                [
+                    "git",
+                    "diff",
+                    "--raw",
+                    "--numstat",
+                    "-z",
+                    "--no-abbrev",
+                    revision,
+                    "HEAD",
+                ],
                 stderr=subprocess.STDOUT,
             )
-            .decode("utf-8")
-            .strip()
         )
-        changed_files = changed_files_output.split("\n") if changed_files_output else []
     except subprocess.CalledProcessError as e:
         print(
             "Error retrieving changed files between",
@@ -109,76 +195,87 @@ def main():
     ################################################################
     # 3. Construct the prompt message with the diff and file contents
     ################################################################
-    review_prompt = []
+    # Write straight into one buffer instead of joining a list of pieces.
+    review_prompt = io.StringIO()
     if generate_pr_desc:
         # If -d flag is provided, generate a pull request description
-        review_prompt.append(
+        review_prompt.write(
             "Please draft a concise, non-technical pull request description based on the following diff.\n"
             "The description should explain the purpose and impact of the changes in plain language.\n\n"
         )
     else:
         # Otherwise, perform a code review
-        review_prompt.append(
+        review_prompt.write(
             "Please provide a code review for the changes in this diff.\n"
             "Remember to also pay attention to the documentation and code consistency.\n"
             "I am not interested in what I have good, I am interested in fixing what I have wrong.\n\n"
             "If you have suggestions on how to fix issues with code examples, please include them.\n\n"
         )
-    review_prompt.append("Below is the diff:\n\n")
-    review_prompt.append(commit_diff.strip())
-    review_prompt.append("\n\n---\n")
+    review_prompt.write("Below is the diff:\n\n")
+    review_prompt.write(commit_diff.strip())
+    review_prompt.write("\n\n---\n")
 
     # For each changed file, if it's smaller than 20kB, include its full content.
-    for cf in changed_files:
-        cf = cf.strip()
-        if cf and os.path.isfile(cf):
-            file_size = os.path.getsize(cf)
-            if file_size < 20000:
-                with open(cf, "r", encoding="utf-8", errors="ignore") as f:
-                    file_content = f.read()
-                review_prompt.append(f"\n# File: {cf}\n")
-                review_prompt.append(file_content)
-                review_prompt.append("\n\n---\n")
-
-    # Combine everything into a single string to send to the model
-    review_message = "".join(review_prompt)
+    # Contents are read from HEAD by the blob names the diff reported, so they
+    # match the diff even when the working tree is dirty, and deleted files are
+    # never looked up. One `git cat-file --batch-check` call gets every size and
+    # one `git cat-file --batch` call reads only the files that are included.
+    text_files = [
+        (path, object_name)
+        for path, is_binary, object_name in changed_files
+        if not is_binary and object_name is not None
+    ]
+    try:
+        blob_sizes = git_blob_sizes([object_name for _, object_name in text_files])
+        # Skip submodules and oversized files.
+        included = [
+            (path, object_name)
+            for (path, object_name), size in zip(text_files, blob_sizes)
+            if size is not None and size < 20000
+        ]
+        contents = git_blob_contents([object_name for _, object_name in included])
+    except subprocess.CalledProcessError as e:
+        print("Error reading changed files from HEAD:\n", e.stderr.decode())
+        return
 
-    ################################################################
-    # 4. Prepare the request to the OpenAI API
-    ################################################################
-    openai_api_key = os.environ["OPENAI_API_KEY"]
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-
-    payload = {
-        "model": "o3-mini",  # The model you'd like to use
-        "reasoning_effort": "high",
-        "messages": [{"role": "user", "content": review_message}],
-    }
+    for (cf, _), file_bytes in zip(included, contents):
+        file_section = (
+            f"\n# File: {cf}\n"
+            + file_bytes.decode("utf-8", errors="ignore")
+            + "\n\n---\n"
+        )
+        # tell() is the number of characters written so far.
+        if (
+            args.max_prompt_chars is not None
+            and review_prompt.tell() + len(file_section) > args.max_prompt_chars
+        ):
+            print(
+                f"Prompt size limit of {args.max_prompt_chars} characters reached, "
+                "leaving out the remaining file contents.\n"
+            )
+            break
+        review_prompt.write(file_section)
+
+    review_message = review_prompt.getvalue()
 
     ################################################################
-    # 5. Send the request and print the result
+    # 4. Send the request and print the result
     ################################################################
     print(f"Reviewing {len(changed_files)} files between {revision} and HEAD...\n")
     try:
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
+        # Re-running on the same diff is served from the cache within --cache-ttl.
+        content = chat(
+            [{"role": "user", "content": review_message}],
+            reasoning_effort="high",
+            use_cache=not args.no_cache,
+            ttl=args.cache_ttl,
             timeout=150,
         )
-        response.raise_for_status()
-        response_json = response.json()
-
-        # The response text is usually in response_json["choices"][0]["message"]["content"]
-        content = response_json["choices"][0]["message"]["content"]
         print(content)
-    except requests.exceptions.RequestException as req_err:
+    except httpx.HTTPError as req_err:
         print(f"Request failed:\n{req_err}")
-    except KeyError:
-        print("Unexpected response format:\n", response.text)
+    except (KeyError, ValueError) as e:
+        print(e)
 
 
 if __name__ == "__main__":